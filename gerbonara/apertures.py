@@ -135,6 +135,14 @@ class ExcellonTool(Aperture):
     #: holes.
     plated : bool = None
     
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def intern(diameter, plated=None, unit=None):
+        """ Return a canonical, shared :py:class:`.ExcellonTool` instance for the given parameters. Since tools are
+        immutable, parsers use this so that logically equal tool definitions map to one single object, which makes
+        object-keyed tool maps during export deduplicate tools for free. """
+        return ExcellonTool(diameter=diameter, plated=plated, unit=unit)
+
     def _primitives(self, x, y, unit=None, polarity_dark=True):
         return [ gp.Circle(x, y, self.unit.convert_to(unit, self.diameter/2), polarity_dark=polarity_dark) ]
 
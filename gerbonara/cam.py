@@ -80,9 +80,58 @@ class FileSettings:
 
         super().__setattr__(name, value)
 
-        if name in ('zeros', 'number_format'):
-            num = self.number_format[1 if self.zeros == 'leading' else 0] or 0
-            self._pad = '0'*num
+        if name == 'number_format':
+            # Precompute the format spec used by write_excellon_value, which is called once per coordinate during
+            # Excellon export.
+            integer_digits, decimal_digits = value or (2, 5)
+            if integer_digits is None:
+                integer_digits = 2
+            if decimal_digits is None:
+                decimal_digits = 6
+            super().__setattr__('_xnc_spec', f'0{integer_digits+decimal_digits+1}.{decimal_digits}f')
+
+            # Same for write_gerber_value, which uses different fallback digit counts.
+            integer_digits, decimal_digits = value or (2, 5)
+            if integer_digits is None:
+                integer_digits = 3
+            if decimal_digits is None:
+                decimal_digits = 3
+            super().__setattr__('_gerber_spec', f'0{integer_digits+decimal_digits+1}.{decimal_digits}f')
+
+        if name in ('number_format', 'zeros'):
+            # Precompute the constants used by parse_gerber_value, which is called once per coordinate during parsing.
+            # Both attributes can legally change mid-file (e.g. from Excellon header commands), so this hook is the one
+            # place that keeps the constants in sync. During dataclass __init__, the other attribute may not have been
+            # assigned yet, hence the getattr defaults; the last of the two assignments settles the final values.
+            integer_digits, decimal_digits = getattr(self, 'number_format', None) or (2, 5)
+            super().__setattr__('_parse_zeros_leading', getattr(self, 'zeros', None) == 'leading')
+            super().__setattr__('_parse_int_digits', integer_digits)
+            super().__setattr__('_parse_leading_div', 10**decimal_digits if decimal_digits is not None else None)
+
+            # Specialize write_gerber_value on the zeros mode so its per-coordinate hot path is branch-free. The
+            # closures must keep the exact semantics of the former inline branches, including the all-zeros edge case
+            # from page 77 of the Gerber spec.
+            spec = getattr(self, '_gerber_spec', '07.3f')
+            zeros = getattr(self, 'zeros', None)
+            if zeros == 'trailing':
+                def fmt(value, spec=spec):
+                    sign = '-' if value < 0 else ''
+                    num = format(abs(value), spec).replace('.', '').rstrip('0')
+                    return sign + (num or '0')
+            elif zeros == 'leading':
+                def fmt(value, spec=spec):
+                    sign = '-' if value < 0 else ''
+                    num = format(abs(value), spec).replace('.', '').lstrip('0')
+                    return sign + (num or '0')
+            else:
+                def fmt(value, spec=spec):
+                    sign = '-' if value < 0 else ''
+                    num = format(abs(value), spec).replace('.', '')
+                    # Edge case. Per Gerber spec if the value is 0 we should return a single '0', see page 77.
+                    if not num.strip('0'):
+                        num = '0'
+                    return sign + num
+            super().__setattr__('_gerber_fmt', fmt)
 
     @classmethod
     def defaults(kls):
@@ -160,60 +209,39 @@ class FileSettings:
 
         if '.' in value or value == '00':
             return float(value)
- 
-        integer_digits, decimal_digits = self.number_format or (2, 5)
 
-        if self.zeros == 'leading':
-            value = self._pad + value # pad with zeros to ensure we have enough decimals
-            return float(value[:-decimal_digits] + '.' + value[-decimal_digits:])
+        # Decode the digit string as an integer and shift the decimal point arithmetically instead of splicing
+        # zero-padded strings. Note that we divide by a positive power of ten instead of multiplying by a negative one
+        # since powers of ten are exact as ints, but not as floats. The settings-derived constants are precomputed in
+        # __setattr__ above.
+        if self._parse_zeros_leading:
+            # The decimal point sits decimal_digits from the right.
+            return int(value) / self._parse_leading_div
 
         else: # no or trailing zero suppression
-            value = value + self._pad
-            return float(value[:integer_digits] + '.' + value[integer_digits:])
+            # The decimal point sits integer_digits from the left.
+            shift = len(value) - self._parse_int_digits
+            if shift <= 0:
+                return float(int(value) * 10**-shift)
+            return int(value) / 10**shift
 
     def write_gerber_value(self, value, unit=None):
         """ Convert a floating point number to a Gerber-formatted string.  """
 
         if unit is not None:
             value = self.unit(value, unit)
-        
-        integer_digits, decimal_digits = self.number_format or (2, 5)
-        if integer_digits is None:
-            integer_digits = 3
-        if decimal_digits is None:
-            decimal_digits = 3
-
-        # negative sign affects padding, so deal with it at the end...
-        sign = '-' if value < 0 else ''
 
+        # The actual formatting lives in a closure precomputed in __setattr__, specialized on the zeros mode so no
+        # per-call branching remains.
         # FIXME never use exponential notation here
-        num = format(abs(value), f'0{integer_digits+decimal_digits+1}.{decimal_digits}f').replace('.', '')
-
-        # Suppression...
-        if self.zeros == 'trailing':
-            num = num.rstrip('0')
-
-        elif self.zeros == 'leading':
-            num = num.lstrip('0')
-
-        # Edge case. Per Gerber spec if the value is 0 we should return a single '0' in all cases, see page 77.
-        elif not num.strip('0'):
-            num = '0'
-
-        return sign + (num or '0')
+        return self._gerber_fmt(value)
 
     def write_excellon_value(self, value, unit=None):
         """ Convert a floating point number to an Excellon-formatted string.  """
         if unit is not None:
             value = self.unit(value, unit)
-        
-        integer_digits, decimal_digits = self.number_format or (2, 5)
-        if integer_digits is None:
-            integer_digits = 2
-        if decimal_digits is None:
-            decimal_digits = 6
-
-        return format(value, f'0{integer_digits+decimal_digits+1}.{decimal_digits}f')
+
+        return format(value, self._xnc_spec)
 
 
 class Polyline:
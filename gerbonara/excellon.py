@@ -17,6 +17,7 @@
 # limitations under the License.
 #
 
+import io
 import math
 import operator
 import warnings
@@ -26,13 +27,28 @@ import re
 from enum import Enum
 from dataclasses import dataclass
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from .cam import CamFile, FileSettings
 from .graphic_objects import Flash, Line, Arc
-from .apertures import ExcellonTool
+from .apertures import CircleAperture, ExcellonTool
 from .utils import Inch, MM, to_unit, InterpMode, RegexMatcher
 
+# Precompiled regexes for the per-line loops below. Python's internal regex cache is small and shared between all
+# users of the re module, so hot loops should not rely on it.
+_ws_re = re.compile(r'\s+')
+_allegro_format_re = re.compile(r'FORMAT ([0-9]+\.[0-9]+)')
+_allegro_int_places_re = re.compile(r'INTEGER-PLACES ([0-9]+)')
+_allegro_dec_places_re = re.compile(r'DECIMAL-PLACES ([0-9]+)')
+_allegro_coords_re = re.compile(r'COORDINATES (ABSOLUTE|.*)')
+_allegro_units_re = re.compile(r'OUTPUT-UNITS (METRIC|ENGLISH|INCHES)')
+_allegro_lz_re = re.compile(r'SUPPRESS-LEAD-ZEROES (YES|NO)')
+_allegro_tz_re = re.compile(r'SUPPRESS-TRAIL-ZEROES (YES|NO)')
+_allegro_tooldef_re = re.compile(r'T(?P<index1>[0-9]+) (?P<index2>[0-9]+)\. (?P<diameter>[0-9/.]+) [0-9. /+-]* (?P<plated>PLATED|NON_PLATED|OPTIONAL) [0-9]+')
+_tool_params_re = re.compile(r'[BCFHSTZ][.0-9]+')
+_line_re = re.compile(r'(?m)^.*$')
+
 class ExcellonContext:
     """ Internal helper class used for tracking graphics state when writing Excellon. """
 
@@ -43,6 +59,7 @@ class ExcellonContext:
         self.current_tool = None
         self.x, self.y = None, None
         self.drill_down = False
+        self._tool_stmts = {} # formatted tool selection statements, filled in lazily
 
     def select_tool(self, tool):
         """ Select the current tool. Retract drill first if necessary. """
@@ -54,7 +71,9 @@ class ExcellonContext:
                 self.drill_down = False
 
             self.current_tool = tool
-            yield f'T{new_id:02d}'
+            if (stmt := self._tool_stmts.get(new_id)) is None:
+                stmt = self._tool_stmts[new_id] = f'T{new_id:02d}'
+            yield stmt
 
     def drill_mode(self):
         """ Enter drill mode. """
@@ -76,7 +95,7 @@ class ExcellonContext:
             yield 'M16' # drill up
 
         # route mode
-        yield 'G00' + 'X' + self.settings.write_excellon_value(x) + 'Y' + self.settings.write_excellon_value(y)
+        yield f'G00X{self.settings.write_excellon_value(x)}Y{self.settings.write_excellon_value(y)}'
         yield 'M15' # drill down
         self.drill_down = True
         self.mode = ProgramState.ROUTING
@@ -100,31 +119,31 @@ def parse_allegro_ncparam(data, settings=None):
     lz_supp, tz_supp = False, False
     nf_int, nf_frac = settings.number_format
     for line in data.splitlines():
-        line = re.sub(r'\s+', ' ', line.strip())
+        line = _ws_re.sub(' ', line.strip())
 
-        if (match := re.fullmatch(r'FORMAT ([0-9]+\.[0-9]+)', line)):
+        if (match := _allegro_format_re.fullmatch(line)):
             x, _, y = match[1].partition('.')
             nf_int, nf_frac = int(x), int(y)
 
-        elif (match := re.fullmatch(r'INTEGER-PLACES ([0-9]+)', line)):
+        elif (match := _allegro_int_places_re.fullmatch(line)):
             nf_int = int(match[1])
 
-        elif (match := re.fullmatch(r'DECIMAL-PLACES ([0-9]+)', line)):
+        elif (match := _allegro_dec_places_re.fullmatch(line)):
             nf_frac = int(match[1])
 
-        elif (match := re.fullmatch(r'COORDINATES (ABSOLUTE|.*)', line)):
+        elif (match := _allegro_coords_re.fullmatch(line)):
             # I have not been able to find a single incremental-notation allegro file. Probably that is for the better.
             settings.notation = match[1].lower()
 
-        elif (match := re.fullmatch(r'OUTPUT-UNITS (METRIC|ENGLISH|INCHES)', line)):
+        elif (match := _allegro_units_re.fullmatch(line)):
             # I have no idea wth is the difference between "ENGLISH" and "INCHES". I think one might just be the one
             # Allegro uses in footprint files, with the other one being used in gerber exports.
             settings.unit = MM if match[1] == 'METRIC' else Inch
 
-        elif (match := re.fullmatch(r'SUPPRESS-LEAD-ZEROES (YES|NO)', line)):
+        elif (match := _allegro_lz_re.fullmatch(line)):
             lz_supp = (match[1] == 'YES')
 
-        elif (match := re.fullmatch(r'SUPPRESS-TRAIL-ZEROES (YES|NO)', line)):
+        elif (match := _allegro_tz_re.fullmatch(line)):
             tz_supp = (match[1] == 'YES')
 
     if lz_supp and tz_supp:
@@ -144,14 +163,14 @@ def parse_allegro_logfile(data):
 
     for line in data.splitlines():
         line = line.strip()
-        line = re.sub(r'\s+', ' ', line)
+        line = _ws_re.sub(' ', line)
 
-        if (m := re.match(r'OUTPUT-UNITS (METRIC|ENGLISH|INCHES)', line)):
+        if (m := _allegro_units_re.match(line)):
             # I have no idea wth is the difference between "ENGLISH" and "INCHES". I think one might just be the one
             # Allegro uses in footprint files, with the other one being used in gerber exports.
             unit = MM if m[1] == 'METRIC' else Inch
 
-        elif (m := re.match(r'T(?P<index1>[0-9]+) (?P<index2>[0-9]+)\. (?P<diameter>[0-9/.]+) [0-9. /+-]* (?P<plated>PLATED|NON_PLATED|OPTIONAL) [0-9]+', line)):
+        elif (m := _allegro_tooldef_re.match(line)):
             index1, index2 = int(m['index1']), int(m['index2'])
             if index1 != index2:
                 return {}
@@ -160,7 +179,7 @@ def parse_allegro_logfile(data):
             if unit == Inch:
                 diameter /= 1000
             is_plated = None if m['plated'] is None else (m['plated'] in ('PLATED', 'OPTIONAL'))
-            found_tools[index1] = ExcellonTool(diameter=diameter, plated=is_plated, unit=unit)
+            found_tools[index1] = ExcellonTool.intern(diameter=diameter, plated=is_plated, unit=unit)
     return found_tools
 
 def parse_zuken_logfile(data):
@@ -216,13 +235,21 @@ class ExcellonFile(CamFile):
     def __repr__(self):
         return str(self)
 
+    @property
+    def _plating_values(self):
+        # Set of distinct plating values in this file, built in a single scan and shared by all plating properties
+        # below. Deliberately not cached: self.objects is a public list that callers mutate freely, so there is no
+        # reliable place to invalidate a cache.
+        return { obj.plated for obj in self.objects }
+
     @property
     def plating_type(self):
-        if self.is_plated:
+        values = self._plating_values
+        if values <= {True}:
             return 'plated'
-        elif self.is_nonplated:
+        elif values <= {False}:
             return 'nonplated'
-        elif self.is_mixed_plating:
+        elif len(values) > 1:
             return 'mixed plating'
         else:
             return 'unknown plating'
@@ -230,22 +257,22 @@ class ExcellonFile(CamFile):
     @property
     def is_plated(self):
         """ Test if *all* holes or slots in this file are plated. """
-        return all(obj.plated for obj in self.objects)
+        return self._plating_values <= {True}
 
     @property
     def is_nonplated(self):
         """ Test if *all* holes or slots in this file are non-plated. """
-        return all(obj.plated == False for obj in self.objects) # False, not None
+        return self._plating_values <= {False} # False, not None
 
     @property
     def is_plating_unknown(self):
         """ Test if *all* holes or slots in this file have no known plating. """
-        return all(obj.plated is None for obj in self.objects) # False, not None
+        return self._plating_values <= {None} # False, not None
 
     @property
     def is_mixed_plating(self):
         """ Test if there are multiple plating values used in this file. """
-        return len({obj.plated for obj in self.objects}) > 1
+        return len(self._plating_values) > 1
 
     @property
     def is_plated_tristate(self):
@@ -270,15 +297,17 @@ class ExcellonFile(CamFile):
 
     def to_gerber(self, errros='raise'):
         """ Convert this excellon file into a :py:class:`~.rs274x.GerberFile`. """
+        from .rs274x import GerberFile
         out = GerberFile()
         out.comments = self.comments
 
         apertures = {}
         for obj in self.objects:
-            if not (ap := apertures[obj.tool]):
+            if not (ap := apertures.get(obj.tool)):
                 ap = apertures[obj.tool] = CircleAperture(obj.tool.diameter)
 
-            out.objects.append(dataclasses.replace(obj, aperture=ap))
+            out.objects.append(obj.with_aperture(ap))
+        return out
 
     @property
     def generator(self):
@@ -343,7 +372,37 @@ class ExcellonFile(CamFile):
                 external_tools = parse_allegro_logfile(log_file.read_text())
 
 
-        return kls.from_string(filename.read_text(), settings=settings,
+        return kls.from_bytes(filename.read_bytes(), settings=settings,
+                filename=filename, plated=plated, external_tools=external_tools)
+
+    @classmethod
+    def open_many(kls, filenames, plated=None, settings=None):
+        """ Load multiple Excellon files from the file system at once, e.g. for bulk imports during panelization.
+
+        This is a convenience wrapper around :py:meth:`~.ExcellonFile.open` that overlaps the file system accesses of
+        all files (including any non-standard settings files found next to them) through a thread pool, which speeds
+        things up when the files are not yet in the OS page cache. The files are parsed with the same settings
+        auto-detection as :py:meth:`~.ExcellonFile.open`.
+
+        :param filenames: iterable of ``str`` or ``pathlib.Path``.
+        :returns: list of :py:class:`.ExcellonFile` in the same order as ``filenames``.
+        """
+
+        filenames = [Path(filename) for filename in filenames]
+        if not filenames:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(len(filenames), 16)) as pool:
+            return list(pool.map(lambda filename: kls.open(filename, plated=plated, settings=settings), filenames))
+
+    @classmethod
+    def from_bytes(kls, data, settings=None, filename=None, plated=None, external_tools=None):
+        """ Parse the given bytes as an Excellon file. Excellon is a text format, so this just decodes the data once up
+        front and hands it to :py:meth:`~.ExcellonFile.from_string`, but without the locale-dependent encoding guess
+        and newline translation that reading the file in text mode would do. See :py:meth:`~.ExcellonFile.from_string`
+        for the caveats about number format detection.
+        """
+        return kls.from_string(data.decode('utf-8'), settings=settings,
                 filename=filename, plated=plated, external_tools=external_tools)
 
     @classmethod
@@ -372,7 +431,11 @@ class ExcellonFile(CamFile):
 
         # Build tool index
         tool_map = { obj.tool: obj.tool for obj in self.objects }
-        tools = sorted(tool_map.items(), key=lambda id_tool: (id_tool[1].plated, id_tool[1].diameter))
+        # Decorate-sort-undecorate: precompute the sort keys in one pass so the sort itself only shuffles indices
+        # through a C-level key function instead of calling back into a lambda per tool.
+        items = list(tool_map.items())
+        keys = [ (tool.plated, tool.diameter) for _, tool in items ]
+        tools = [ items[i] for i in sorted(range(len(items)), key=keys.__getitem__) ]
 
         mixed_plating = (len({ tool.plated for tool in tool_map.values() }) > 1)
         if mixed_plating:
@@ -420,6 +483,12 @@ class ExcellonFile(CamFile):
         :rtype: str
         """
 
+        settings = self._export_settings(settings)
+        f = io.StringIO()
+        self._write_to(f, settings, drop_comments=drop_comments)
+        return f.getvalue().encode('utf-8')
+
+    def _export_settings(self, settings):
         if settings is None:
             if self.import_settings:
                 settings = self.import_settings.copy()
@@ -427,13 +496,21 @@ class ExcellonFile(CamFile):
                 settings.number_format = (3,5)
             else:
                 settings = FileSettings.defaults()
-        return '\n'.join(self._generate_statements(settings, drop_comments=drop_comments)).encode('utf-8')
+        return settings
+
+    def _write_to(self, f, settings, drop_comments=True):
+        sep = ''
+        for stmt in self._generate_statements(settings, drop_comments=drop_comments):
+            f.write(sep)
+            f.write(stmt)
+            sep = '\n'
 
     def save(self, filename, settings=None, drop_comments=True):
         """ Save this Excellon file to the file system. See :py:meth:`~.ExcellonFile.generate_excellon` for the meaning
         of the arguments. """
-        with open(filename, 'wb') as f:
-            f.write(self.write_to_bytes(settings, drop_comments=drop_comments))
+        settings = self._export_settings(settings)
+        with open(filename, 'w', buffering=1<<20, encoding='utf-8', newline='') as f:
+            self._write_to(f, settings, drop_comments=drop_comments)
 
     def offset(self, x=0, y=0, unit=MM):
         for obj in self.objects:
@@ -486,22 +563,31 @@ class ExcellonFile(CamFile):
         :returns: ``{ tool: float(path length) }``
         :rtype dict:
         """
-        lengths = {}
-        tool = None
-        for obj in sorted(self.objects, key=lambda obj: obj.tool):
-            if tool != obj.tool:
-                tool = obj.tool
-                lengths[tool] = 0
+        return { tool: sum(obj.curve_length(unit) for obj in objs) for tool, objs in self.by_tool().items() }
+
+    def by_tool(self):
+        """ Group this file's objects by the tool they use.
+
+        Building this index takes a single pass over :py:attr:`objects`, so pipelines that need several per-tool
+        statistics can call this once and derive them all instead of re-scanning the file per statistic. The result is
+        a fresh dict; it is not cached since :py:attr:`objects` is a public list that callers may modify at any time.
 
-            lengths[tool] += obj.curve_length(unit)
-        return lengths
+        :returns: ``{ tool: [objects using that tool] }``
+        :rtype: dict
+        """
+        by_tool = {}
+        for obj in self.objects:
+            by_tool.setdefault(obj.tool, []).append(obj)
+        return by_tool
 
     def hit_count(self):
         """ Calculate the number of objects per tool.
 
         :rtype: collections.Counter
         """
-        return Counter(obj.tool for obj in self.objects)
+        # map() instead of a generator expression so counting runs entirely through Counter's C-accelerated
+        # _count_elements helper without a Python generator frame in the loop.
+        return Counter(map(operator.attrgetter('tool'), self.objects))
 
     def drill_sizes(self, unit=MM):
         """ Return a sorted list of all tool diameters found in this file.
@@ -512,7 +598,7 @@ class ExcellonFile(CamFile):
         :rtype: list
         """
         # use equivalent_width for unit conversion
-        return sorted({ obj.tool.equivalent_width(unit) for obj in self.objects })
+        return sorted({ tool.equivalent_width(unit) for tool in self.by_tool() })
 
     def drills(self):
         """ Return all drilled hole objects in this file.
@@ -575,8 +661,13 @@ class ExcellonParser(object):
         self.filename = filename = filename or '<unknown>'
 
         leftover = None
-        for lineno, line in enumerate(data.splitlines(), start=1):
-            line = line.strip()
+        # The expression registry lives on the class, so the combined pattern is compiled once per process, not per
+        # parser instance or per file. Bind the dispatch method to a local for the loop below.
+        handle = self.exprs.handle
+        # Iterate match-by-match instead of materializing the whole file into a list with splitlines(). This matches
+        # empty lines, too, so line numbers in warnings stay accurate.
+        for lineno, line_match in enumerate(_line_re.finditer(data), start=1):
+            line = line_match[0].strip()
             self.lineno, self.line = lineno, line # for warnings
 
             if not line:
@@ -598,7 +689,7 @@ class ExcellonParser(object):
             # TODO check first command in file is "start of header" command.
 
             try:
-                if not self.exprs.handle(self, line):
+                if not handle(self, line):
                     raise ValueError('Unknown excellon statement:', line)
             except Exception as e:
                 raise SyntaxError(f'{filename}:{lineno} "{line}": {e}') from e
@@ -635,13 +726,13 @@ class ExcellonParser(object):
                     'file should be in {settings.unit.name}. Please double-check that this is correct, and if it is, '
                     'please raise an issue on our issue tracker.')
 
-        self.tools[index] = ExcellonTool(diameter=diameter, plated=is_plated, unit=unit)
+        self.tools[index] = ExcellonTool.intern(diameter=diameter, plated=is_plated, unit=unit)
 
     # Searching Github I found that EasyEDA has two different variants of the unit specification here.
     @exprs.match(';Holesize (?P<index>[0-9]+) = (?P<diameter>[.0-9]+) (?P<unit>INCH|inch|METRIC|mm)')
     def parse_easyeda_tooldef(self, match):
         unit = Inch if match['unit'].lower() == 'inch' else MM
-        tool = ExcellonTool(diameter=float(match['diameter']), unit=unit, plated=self.is_plated)
+        tool = ExcellonTool.intern(diameter=float(match['diameter']), unit=unit, plated=self.is_plated)
 
         if (index := int(match['index'])) in self.tools:
             self.warn('Re-definition of tool index {index}, overwriting old definition.') 
@@ -657,9 +748,9 @@ class ExcellonParser(object):
         if (index := int(match[1])) in self.tools:
             self.warn('Re-definition of tool index {index}, overwriting old definition.') 
 
-        params = { m[0]: self.settings.parse_gerber_value(m[1:]) for m in re.findall('[BCFHSTZ][.0-9]+', match[2]) }
+        params = { m[0]: self.settings.parse_gerber_value(m[1:]) for m in _tool_params_re.findall(match[2]) }
 
-        self.tools[index] = ExcellonTool(diameter=params.get('C'), plated=self.is_plated,
+        self.tools[index] = ExcellonTool.intern(diameter=params.get('C'), plated=self.is_plated,
                 unit=self.settings.unit)
 
         if set(params.keys()) == set('TFSC'):
@@ -713,14 +804,15 @@ class ExcellonParser(object):
             self.objects.append(Flash(*self.pos, self.active_tool, unit=self.settings.unit))
 
     def header_command(name):
+        # Prebuild the warning strings at class definition time so that in the common case, the wrapper does nothing
+        # but a single enum comparison before calling through.
         def wrap(fun):
+            warn_before = f'{name} header statement found before start of header'
+            warn_after = f'{name} header statement found after end of header'
             @functools.wraps(fun)
             def wrapper(self, *args, **kwargs):
-                nonlocal name
-                if self.program_state is None:
-                    self.warn(f'{name} header statement found before start of header')
-                elif self.program_state != ProgramState.HEADER:
-                    self.warn(f'{name} header statement found after end of header')
+                if self.program_state != ProgramState.HEADER:
+                    self.warn(warn_before if self.program_state is None else warn_after)
                 fun(self, *args, **kwargs)
             return wrapper
         return wrap
@@ -761,8 +853,9 @@ class ExcellonParser(object):
 
     def do_move(self, coord_groups):
         x_s, x, y_s, y = coord_groups
+        settings = self.settings
 
-        if self.settings.number_format == (None, None) and '.' not in x:
+        if settings.number_format == (None, None) and '.' not in x:
             # TARGET3001! exports zeros as "00" even when it uses an explicit decimal point everywhere else.
             if x != '00':
                 raise SyntaxError('No number format set and value does not contain a decimal point. If this is an Allegro '
@@ -771,16 +864,16 @@ class ExcellonParser(object):
                     'call this through ExcellonFile.from_string, you must manually supply from_string with a '
                     'FileSettings object from excellon.parse_allegro_ncparam.')
 
-        x = self.settings.parse_gerber_value(x)
+        x = settings.parse_gerber_value(x)
         if x_s:
             x = -x
-        y = self.settings.parse_gerber_value(y)
+        y = settings.parse_gerber_value(y)
         if y_s:
             y = -y
 
         old_pos = self.pos
 
-        if self.settings.is_absolute:
+        if settings.is_absolute:
             if x is not None:
                 self.pos = (x, self.pos[1])
             if y is not None:
@@ -833,6 +926,7 @@ class ExcellonParser(object):
     
     def do_interpolation(self, coord_groups):
         x_s, x, y_s, y, a_s, a, i_s, i, j_s, j = coord_groups
+        settings = self.settings
 
         start, end = self.do_move((x_s, x, y_s, y))
 
@@ -846,7 +940,7 @@ class ExcellonParser(object):
             if a or i or j:
                 self.warn('A/I/J arc coordinates found in linear mode.')
 
-            self.objects.append(Line(*start, *end, self.active_tool, unit=self.settings.unit))
+            self.objects.append(Line(*start, *end, self.active_tool, unit=settings.unit))
 
         else:
             if (x or y) and not (a or i or j):
@@ -885,7 +979,7 @@ class ExcellonParser(object):
                 if j_s:
                     j = -i
 
-            self.objects.append(Arc(*start, *end, i, j, True, self.active_tool, unit=self.settings.unit))
+            self.objects.append(Arc(*start, *end, i, j, True, self.active_tool, unit=settings.unit))
 
     @exprs.match(r'(M71|METRIC|M72|INCH)(,LZ|,TZ)?(,0*\.0*)?')
     def parse_easyeda_format(self, match):
@@ -1048,9 +1142,12 @@ class ExcellonParser(object):
 
     @exprs.match(';(.*)')
     def parse_comment(self, match):
-        self.comments.append(match[1].strip())
+        comment = match[1].strip()
+        self.comments.append(comment)
 
-        if all(cmt.startswith(marker)
+        # Cheap gate: the four-marker check below can only succeed when the comment just appended is the 'Version'
+        # line, so skip it (and its reversed() wrapper) for every other comment.
+        if comment.startswith('Version') and all(cmt.startswith(marker)
                 for cmt, marker in zip(reversed(self.comments), ['Version', 'Job', 'User', 'Date'])):
             self.generator_hints.append('siemens')
 
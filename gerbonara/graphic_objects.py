@@ -18,22 +18,15 @@
 
 import math
 import copy
-from dataclasses import dataclass, astuple, field, fields
+import functools
+from dataclasses import dataclass, field, fields
 from itertools import zip_longest, pairwise, islice, cycle
 
-from .utils import MM, InterpMode, to_unit, rotate_point, sum_bounds, approximate_arc, sweep_angle
+from .utils import MM, InterpMode, to_unit, rotate_point, rotate_points, sum_bounds, approximate_arc, sweep_angle
 from . import graphic_primitives as gp
 from .aperture_macros import primitive as amp
 
 
-def convert(value, src, dst):
-        if src == dst or src is None or dst is None or value is None:
-            return value
-        elif dst == MM:
-            return value * 25.4
-        else:
-            return value / 25.4
-
 class Length:
     def __init__(self, obj_type):
         self.type = obj_type
@@ -42,14 +35,30 @@ class Length:
         # This makes the automatically generated method signatures in the Sphinx docs look nice
         return 'float'
 
+
+@functools.lru_cache(maxsize=None)
+def _length_fields(klass):
+    # Cached per class: convert_to below runs for every single object during unit conversion passes, and
+    # dataclasses.fields() reflection plus the Length filter is too expensive to redo each time.
+    return tuple(f.name for f in fields(klass) if type(f.type) is Length)
+
 class GraphicObject:
     """ Base class for the graphic objects that make up a :py:class:`.GerberFile` or :py:class:`.ExcellonFile`. """
 
+    # Empty slots on the base class so the slotted dataclass subclasses below do not grow a per-instance __dict__
+    # through inheritance. Subclasses that want a __dict__ (like Region) simply do not declare __slots__ themselves.
+    __slots__ = ()
+
     # hackety hack: Work around python < 3.10 not having dataclasses.KW_ONLY. Once we drop python 3.8 and 3.9, we can
     # get rid of this, just set these as normal fields, and decorate GraphicObject with @dataclass.
-    # 
+    #
     # See also: apertures.py, graphic_primitives.py
     def __init_subclass__(cls):
+        # @dataclass(slots=True) re-creates the class, which runs this hook a second time. By then the fields are
+        # slot descriptors that the class attribute assignments below would clobber, so bail out.
+        if '__slots__' in cls.__dict__:
+            return
+
         #: bool representing the *color* of this feature: whether this is a *dark* or *clear* feature. Clear and dark are
         #: meant in the sense that they are used in the Gerber spec and refer to whether the transparency film that this
         #: file describes ends up black or clear at this spot. In a standard green PCB, a *polarity_dark=True* line will
@@ -72,6 +81,17 @@ class GraphicObject:
             cls.__annotations__ = d
 
 
+    def with_aperture(self, aperture):
+        """ Return a shallow copy of this object with its aperture replaced.
+
+        :param aperture: Aperture to use in the copy.
+
+        :returns: A copy of this object using the given aperture.
+        """
+        obj = copy.copy(self)
+        obj.aperture = aperture
+        return obj
+
     def converted(self, unit):
         """ Convert this gerber object to another :py:class:`.LengthUnit`.
 
@@ -89,11 +109,15 @@ class GraphicObject:
         :param unit: Either a :py:class:`.LengthUnit` instance or one of the strings ``'mm'`` or ``'inch'``.
         """
 
-        for f in fields(self):
-            if type(f.type) is Length:
-                setattr(self, f.name, self.unit.convert_to(unit, getattr(self, f.name)))
+        unit = to_unit(unit)
+
+        # Short-circuit the common no-op case so converting a file that is already in the target unit does not walk
+        # every field of every object.
+        if unit != self.unit:
+            for name in _length_fields(type(self)):
+                setattr(self, name, self.unit.convert_to(unit, getattr(self, name)))
 
-        self.unit = to_unit(unit)
+        self.unit = unit
 
     def offset(self, dx, dy, unit=MM):
         """ Add an offset to the location of this feature. The location can be given in either unit, and is
@@ -154,6 +178,19 @@ class GraphicObject:
 
         return sum_bounds(p.bounding_box() for p in self.to_primitives(unit))
 
+    def primitives_and_bbox(self, unit=None):
+        """ Fused version of :py:meth:`to_primitives` and :py:meth:`bounding_box` for callers that need both: yields
+        ``(primitive, ((min_x, min_y), (max_x, max_y)))`` tuples, so the primitives are only generated once instead of
+        once per output.
+
+        :param unit: :py:class:`.LengthUnit` or str with unit for return value.
+
+        :rtype: Iterator[tuple]
+        """
+
+        for p in self.to_primitives(unit):
+            yield p, p.bounding_box()
+
     def to_primitives(self, unit=None):
         """ Render this object into low-level graphical primitives (subclasses of :py:class:`.GraphicPrimitive`). This
         computes out all coordinates in case aperture macros are involved, and resolves units. The output primitives are
@@ -186,7 +223,7 @@ class GraphicObject:
         """
 
 
-@dataclass
+@dataclass(slots=True)
 class Flash(GraphicObject):
     """ A flash is what happens when you "stamp" a Gerber aperture at some location. The :py:attr:`polarity_dark`
     attribute that Flash inherits from :py:class:`.GraphicObject` is ``True`` for normal flashes. If you set a Flash's
@@ -245,8 +282,9 @@ class Flash(GraphicObject):
         yield from gs.set_polarity(self.polarity_dark)
         yield from gs.set_aperture(self.aperture)
 
-        x = gs.file_settings.write_gerber_value(self.x, self.unit)
-        y = gs.file_settings.write_gerber_value(self.y, self.unit)
+        write = gs.file_settings.write_gerber_value
+        x = write(self.x, self.unit)
+        y = write(self.y, self.unit)
         yield f'X{x}Y{y}D03*'
 
         gs.update_point(self.x, self.y, unit=self.unit)
@@ -307,11 +345,18 @@ class Region(GraphicObject):
 
     def _offset(self, dx, dy):
         self.outline = [ (x+dx, y+dy) for x, y in self.outline ]
+        self.arc_centers = [
+                (arc[0], (arc[1][0]+dx, arc[1][1]+dy)) if arc else None
+                for arc in self.arc_centers ]
 
     def _rotate(self, angle, cx=0, cy=0):
-        self.outline = [ gp.rotate_point(x, y, angle, cx, cy) for x, y in self.outline ]
+        # Batch-rotate the outline and arc centers with a single shared rotation matrix instead of re-deriving it per
+        # point in gp.rotate_point.
+        self.outline = rotate_points(self.outline, angle, cx, cy)
+        cos, sin = math.cos(-angle), math.sin(-angle)
         self.arc_centers = [
-                (arc[0], gp.rotate_point(*arc[1], angle, cx, cy)) if arc else None
+                (arc[0], (cx + (arc[1][0] - cx) * cos - (arc[1][1] - cy) * sin,
+                          cy + (arc[1][0] - cx) * sin + (arc[1][1] - cy) * cos)) if arc else None
                 for arc in self.arc_centers ]
 
     def _scale(self, factor):
@@ -399,14 +444,17 @@ class Region(GraphicObject):
         yield amp.Outline(self.unit, int(self.polarity_dark), len(points)-1, tuple(coord for p in points for coord in p))
 
     def to_primitives(self, unit=None):
-        if unit == self.unit:
+        unit = to_unit(unit)
+        if unit is None or unit == self.unit:
             yield gp.ArcPoly(outline=self.outline, arc_centers=self.arc_centers, polarity_dark=self.polarity_dark)
 
         else:
-            to = lambda value: self.unit.convert_to(unit, value)
-            conv_outline = [ (to(x), to(y)) for x, y in self.outline ]
-            convert_entry = lambda entry: (entry[0], (to(entry[1][0]), to(entry[1][1])))
-            conv_arc = [ None if entry is None else convert_entry(entry) for entry in self.arc_centers ]
+            # Inline the conversion arithmetic instead of calling convert_to through a lambda four times per vertex.
+            # This is the same multiply/divide convert_to does, so results are bit-identical.
+            a, b = self.unit.this_in_mm, unit.this_in_mm
+            conv_outline = [ (x*a/b, y*a/b) for x, y in self.outline ]
+            conv_arc = [ None if entry is None else (entry[0], (entry[1][0]*a/b, entry[1][1]*a/b))
+                    for entry in self.arc_centers ]
 
             yield gp.ArcPoly(conv_outline, conv_arc, polarity_dark=self.polarity_dark)
 
@@ -423,28 +471,34 @@ class Region(GraphicObject):
 
         yield from gs.set_current_point(self.outline[0], unit=self.unit)
 
+        # Bound to locals since this loop runs once per vertex of potentially huge outlines.
+        write = gs.file_settings.write_gerber_value
+        set_interpolation_mode = gs.set_interpolation_mode
+        update_point = gs.update_point
+        unit = self.unit
+
         for previous_point, point, (clockwise, center) in self.iter_segments():
             if point is None and center is None:
                 break
 
-            x = gs.file_settings.write_gerber_value(point[0], self.unit)
-            y = gs.file_settings.write_gerber_value(point[1], self.unit)
+            x = write(point[0], unit)
+            y = write(point[1], unit)
 
             if clockwise is None:
-                yield from gs.set_interpolation_mode(InterpMode.LINEAR)
+                yield from set_interpolation_mode(InterpMode.LINEAR)
                 yield f'X{x}Y{y}D01*'
 
             else:
-                yield from gs.set_interpolation_mode(InterpMode.CIRCULAR_CW if clockwise else InterpMode.CIRCULAR_CCW)
-                i = gs.file_settings.write_gerber_value(center[0]-previous_point[0], self.unit)
-                j = gs.file_settings.write_gerber_value(center[1]-previous_point[1], self.unit)
+                yield from set_interpolation_mode(InterpMode.CIRCULAR_CW if clockwise else InterpMode.CIRCULAR_CCW)
+                i = write(center[0]-previous_point[0], unit)
+                j = write(center[1]-previous_point[1], unit)
                 yield f'X{x}Y{y}I{i}J{j}D01*'
 
-            gs.update_point(*point, unit=self.unit)
+            update_point(*point, unit=unit)
 
         yield 'G37*'
 
-@dataclass
+@dataclass(slots=True)
 class Line(GraphicObject):
     """ A line is what happens when you "drag" a Gerber :py:class:`.Aperture` from one point to another. Note that
     Gerber lines are substantially funkier than normal lines as we know them from modern computer graphics such as SVG.
@@ -534,8 +588,9 @@ class Line(GraphicObject):
         yield from gs.set_interpolation_mode(InterpMode.LINEAR)
         yield from gs.set_current_point(self.p1, unit=self.unit)
 
-        x = gs.file_settings.write_gerber_value(self.x2, self.unit)
-        y = gs.file_settings.write_gerber_value(self.y2, self.unit)
+        write = gs.file_settings.write_gerber_value
+        x = write(self.x2, self.unit)
+        y = write(self.y2, self.unit)
         yield f'X{x}Y{y}D01*'
 
         gs.update_point(*self.p2, unit=self.unit)
@@ -555,7 +610,7 @@ class Line(GraphicObject):
         return self.unit.convert_to(unit, math.dist(self.p1, self.p2))
 
 
-@dataclass
+@dataclass(slots=True)
 class Arc(GraphicObject):
     """ Like :py:class:`~.graphic_objects.Line`, but a circular arc. Has start ``(x1, y1)`` and end ``(x2, y2)``
     attributes like a :py:class:`~.graphic_objects.Line`, but additionally has a center ``(cx, cy)`` specified relative
@@ -737,10 +792,11 @@ class Arc(GraphicObject):
         yield from gs.set_interpolation_mode(InterpMode.CIRCULAR_CW if self.clockwise else InterpMode.CIRCULAR_CCW)
         yield from gs.set_current_point(self.p1, unit=self.unit)
 
-        x = gs.file_settings.write_gerber_value(self.x2, self.unit)
-        y = gs.file_settings.write_gerber_value(self.y2, self.unit)
-        i = gs.file_settings.write_gerber_value(self.cx, self.unit)
-        j = gs.file_settings.write_gerber_value(self.cy, self.unit)
+        write = gs.file_settings.write_gerber_value
+        x = write(self.x2, self.unit)
+        y = write(self.y2, self.unit)
+        i = write(self.cx, self.unit)
+        j = write(self.cy, self.unit)
         yield f'X{x}Y{y}I{i}J{j}D01*'
 
         gs.update_point(*self.p2, unit=self.unit)
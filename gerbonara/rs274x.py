@@ -19,16 +19,19 @@
 # limitations under the License.
 #
 
+import io
+import os
 import re
 import math
 import copy
+import bisect
 import warnings
 from pathlib import Path
 import dataclasses
 import functools
 
 from .cam import CamFile, FileSettings
-from .utils import MM, Inch, units, InterpMode, UnknownStatementWarning
+from .utils import MM, Inch, units, InterpMode, UnknownStatementWarning, _MatchProxy, _rename_groups
 from .aperture_macros.parse import ApertureMacro, GenericMacros
 from . import graphic_primitives as gp
 from . import graphic_objects as go
@@ -36,15 +39,21 @@ from . import apertures
 from .excellon import ExcellonFile
 
 
+# Compiled once at import instead of hitting the re module cache on every parse() call.
+_COMMAND_SPLIT_RE = re.compile(r'G04.*?\*\s*|%.*?%\s*|[^*%]*\*\s*', re.DOTALL)
+_NON_WORD_RE = re.compile(r'\W+')
+
+
 def points_close(a, b):
     if a == b:
         return True
     elif a is None or b is None:
         return False
-    elif None in a or None in b:
+    ax, ay = a
+    bx, by = b
+    if ax is None or ay is None or bx is None or by is None:
         return False
-    else:
-        return math.isclose(a[0], b[0]) and math.isclose(a[1], b[1])
+    return math.isclose(ax, bx) and math.isclose(ay, by)
 
 class GerberFile(CamFile):
     """ A single gerber file.
@@ -111,7 +120,9 @@ class GerberFile(CamFile):
             map_or_callable = lambda ap: d.get(ap, ap)
 
         for obj in self.objects:
-            if (aperture := getattr(obj, 'aperture', None)):
+            # isinstance against the apertured types is cheaper than getattr with a default, which has to swallow an
+            # AttributeError for every Region.
+            if isinstance(obj, (go.Line, go.Arc, go.Flash)) and (aperture := obj.aperture):
                 obj.aperture = map_or_callable(aperture)
 
     def dedup_apertures(self, settings=None):
@@ -127,12 +138,15 @@ class GerberFile(CamFile):
             settings = FileSettings.defaults()
 
         cache = {}
+        macro_defs = {}
         macro_names = set()
         def lookup(aperture):
             nonlocal cache, settings
             if isinstance(aperture, apertures.ApertureMacroInstance):
                 macro = aperture.macro
-                macro_def = macro.to_gerber(settings)
+                # Distinct macro instances often share one macro object; serialize each macro only once.
+                if (macro_def := macro_defs.get(id(macro))) is None:
+                    macro_def = macro_defs[id(macro)] = macro.to_gerber(settings)
                 if macro_def not in cache:
                     cache[macro_def] = macro
 
@@ -175,7 +189,7 @@ class GerberFile(CamFile):
             if not (new_tool := new_tools.get(obj.aperture)):
                 # TODO plating?
                 new_tool = new_tools[obj.aperture] = apertures.ExcellonTool(obj.aperture.diameter, plated=plated, unit=obj.aperture.unit)
-            new_objs.append(dataclasses.replace(obj, aperture=new_tool))
+            new_objs.append(obj.with_aperture(new_tool))
             
         return ExcellonFile(objects=new_objs, comments=self.comments)
 
@@ -319,11 +333,30 @@ class GerberFile(CamFile):
     def __repr__(self):
         return str(self)
 
+    def _export_settings(self, settings):
+        if settings is None:
+            if self.import_settings:
+                settings = self.import_settings.copy()
+                settings.zeros = None
+            else:
+                settings = FileSettings.defaults()
+        return settings
+
+    def _write_to(self, f, settings, drop_comments=True):
+        sep = ''
+        for stmt in self._generate_statements(settings, drop_comments=drop_comments):
+            f.write(sep)
+            f.write(stmt)
+            sep = '\n'
+
     def save(self, filename, settings=None, drop_comments=True):
         """ Save this Gerber file to the file system. See :py:meth:`~.GerberFile.generate_gerber` for the meaning
         of the arguments. """
-        with open(filename, 'wb') as f: # Encoding is specified as UTF-8 by spec.
-            f.write(self.write_to_bytes(settings, drop_comments=drop_comments))
+        settings = self._export_settings(settings)
+        # Stream statements straight into a buffered file instead of materializing the whole output in memory first.
+        # Encoding is specified as UTF-8 by spec.
+        with open(filename, 'w', buffering=1<<20, encoding='utf-8', newline='') as f:
+            self._write_to(f, settings, drop_comments=drop_comments)
 
     def write_to_bytes(self, settings=None, drop_comments=True):
         """ Export to Gerber format. Uses either the file's original settings or sane default settings if you don't give
@@ -333,16 +366,13 @@ class GerberFile(CamFile):
         :param bool drop_comments: If true, do not write comments to output file. This defaults to true because
                 otherwise there is a risk that Gerbonara does not consider some obscure magic comment semantically
                 meaningful while some other Excellon viewer might still parse it.
-        
+
         :rtype: str
         """
-        if settings is None:
-            if self.import_settings:
-                settings = self.import_settings.copy()
-                settings.zeros = None
-            else:
-                settings = FileSettings.defaults()
-        return '\n'.join(self._generate_statements(settings, drop_comments=drop_comments)).encode('utf-8')
+        settings = self._export_settings(settings)
+        f = io.StringIO()
+        self._write_to(f, settings, drop_comments=drop_comments)
+        return f.getvalue().encode('utf-8')
 
     def __len__(self):
         return len(self.objects)
@@ -357,8 +387,13 @@ class GerberFile(CamFile):
 
     def offset(self, dx=0,  dy=0, unit=MM):
         # TODO round offset to file resolution
+        # Since in practice all objects of a file share one unit, convert the offset once per unit seen instead of
+        # once per object, and call the low-level transform hook directly.
+        converted = {}
         for obj in self.objects:
-            obj.offset(dx, dy, unit)
+            if (delta := converted.get(obj.unit)) is None:
+                delta = converted[obj.unit] = (obj.unit(dx, unit), obj.unit(dy, unit))
+            obj._offset(*delta)
 
     def rotate(self, angle:'radian', cx=0, cy=0, unit=MM):
         if math.isclose(angle % (2*math.pi), 0):
@@ -366,8 +401,12 @@ class GerberFile(CamFile):
 
         self.map_apertures(lambda ap: ap.rotated(angle))
 
+        # Same hoisting as in offset above: convert the rotation center once per unit, not once per object.
+        converted = {}
         for obj in self.objects:
-            obj.rotate(angle, cx, cy, unit)
+            if (center := converted.get(obj.unit)) is None:
+                center = converted[obj.unit] = (obj.unit(cx, unit), obj.unit(cy, unit))
+            obj._rotate(angle, *center)
 
     def invert_polarity(self):
         """ Invert the polarity (color) of each object in this file. """
@@ -379,6 +418,11 @@ class GraphicsState:
     """ Internal class used to track Gerber processing state during import and export.
     """
 
+    __slots__ = ('image_polarity', '_polarity_dark', 'point', 'aperture', 'interpolation_mode', 'multi_quadrant_mode',
+                 'aperture_mirroring', 'aperture_rotation', 'aperture_scale', 'image_offset', 'image_rotation',
+                 'image_mirror', 'image_scale', 'output_axes', '_mat', '_xform_is_identity', 'file_settings', 'unit',
+                 'aperture_map', 'warn', 'unit_warning', 'object_attrs', '_width_checked_aperture', '_width_is_zero')
+
     def __init__(self, warn, file_settings=None, aperture_map=None):
         self.image_polarity = 'positive' # IP image polarity; deprecated
         self.polarity_dark = True
@@ -401,6 +445,8 @@ class GraphicsState:
         self.warn = warn
         self.unit_warning = False
         self.object_attrs = {}
+        self._width_checked_aperture = None
+        self._width_is_zero = False
 
     @property
     def polarity_dark(self):
@@ -438,20 +484,27 @@ class GraphicsState:
             off_x, off_y = -off_y, off_x
 
         self.image_offset = off_x, off_y
-        self._mat = a, b, c, d
-    
+        # The offset is folded into the cached tuple so map_coord does a single attribute load per point.
+        self._mat = a, b, c, d, off_x, off_y
+        # Nearly all files use none of the deprecated image transform statements, so map_coord below can skip the
+        # whole matrix multiply for them.
+        self._xform_is_identity = (a, b, c, d) == (1, 0, 0, 1) and off_x == 0 and off_y == 0
+
     def map_coord(self, x, y, relative=False):
         if self._mat is None:
             self._update_xform()
-        a, b, c, d = self._mat
+
+        if self._xform_is_identity:
+            # The +0.0 matches the full arithmetic below exactly: it normalizes -0.0 to 0.0 and ints to floats.
+            return x + 0.0, y + 0.0
+
+        a, b, c, d, off_x, off_y = self._mat
 
         if not relative:
-            rx, ry = (a*x + b*y + self.image_offset[0]), (c*x + d*y + self.image_offset[1])
-            return rx, ry
+            return (a*x + b*y + off_x), (c*x + d*y + off_y)
         else:
             # Apply mirroring, scale and rotation, but do not apply offset
-            rx, ry = (a*x + b*y), (c*x + d*y)
-            return rx, ry
+            return (a*x + b*y), (c*x + d*y)
 
     def flash(self, x, y):
         if self.unit is None:
@@ -473,7 +526,13 @@ class GraphicsState:
             if (aperture := self.aperture) is None:
                 raise SyntaxError('Interpolation attempted without selecting aperture first')
 
-            if math.isclose(aperture.equivalent_width(), 0):
+            # Consecutive interpolations almost always use the same aperture, so remember the width check result
+            # instead of re-deriving the equivalent width per D01.
+            if aperture is not self._width_checked_aperture:
+                self._width_checked_aperture = aperture
+                self._width_is_zero = math.isclose(aperture.equivalent_width(), 0)
+
+            if self._width_is_zero:
                 self.warn('D01 interpolation with a zero-size aperture. This is invalid according to spec, '
                         'however, we pass through the created objects here. Note that these will not show up in e.g. '
                         'SVG output since their line width is zero.')
@@ -520,16 +579,19 @@ class GraphicsState:
                     # Super-legacy. No one uses this EXCEPT everything that mentor graphics / siemens make uses this m(
                     (cx, cy) = self.map_coord(i, j, relative=True)
 
-                    arc = lambda cx, cy: go.Arc(*old_point, *new_point, cx, cy,
-                            clockwise=clockwise, aperture=aperture,
-                            polarity_dark=self._polarity_dark, unit=unit, attrs=self.object_attrs)
-                    arcs = [ arc(cx, cy), arc(-cx, cy), arc(cx, -cy), arc(-cx, -cy) ]
-                    arcs = sorted(arcs, key=lambda a: a.numeric_error())
+                    # Score the four candidate centers directly and only construct the single arc we keep, instead of
+                    # building four Arc objects and throwing three away.
+                    x1, y1 = old_point
+                    def error(c):
+                        center = x1 + c[0], y1 + c[1]
+                        return abs(math.dist(center, old_point) - math.dist(center, new_point))
 
-                    for a in arcs:
-                        d = gp.point_line_distance(old_point, new_point, (old_point[0]+a.cx, old_point[1]+a.cy))
+                    for ccx, ccy in sorted([(cx, cy), (-cx, cy), (cx, -cy), (-cx, -cy)], key=error):
+                        d = gp.point_line_distance(old_point, new_point, (x1 + ccx, y1 + ccy))
                         if (d > 0) == clockwise:
-                            return a
+                            return go.Arc(*old_point, *new_point, ccx, ccy,
+                                    clockwise=clockwise, aperture=aperture,
+                                    polarity_dark=self._polarity_dark, unit=unit, attrs=self.object_attrs)
                     assert False
 
     def update_point(self, x, y, unit=None):
@@ -561,6 +623,10 @@ class GraphicsState:
             yield '%LPD*%' if polarity_dark else '%LPC*%'
 
     def set_aperture(self, aperture):
+        if aperture is self.aperture:
+            # Fast path: after dedup_apertures, equal apertures are the same object, so consecutive objects using the
+            # same aperture skip the dict lookups (and the dataclass field hashing they imply) entirely.
+            return
         ap_id = self.aperture_map[aperture]
         old_ap_id = self.aperture_map.get(self.aperture, None)
         if ap_id != old_ap_id:
@@ -568,7 +634,11 @@ class GraphicsState:
             yield f'D{ap_id}*'
 
     def set_current_point(self, point, unit=None):
-        point_mm = MM(point[0], unit), MM(point[1], unit)
+        if unit is MM or unit is None:
+            # MM(value, MM) and MM(value, None) are identity conversions, no need to rebuild the tuple.
+            point_mm = point
+        else:
+            point_mm = MM(point[0], unit), MM(point[1], unit)
         # TODO calculate appropriate precision for math.isclose given file_settings.notation
 
         if not points_close(self.point, point_mm):
@@ -582,11 +652,14 @@ class GraphicsState:
             self.interpolation_mode = mode
             yield self.interpolation_mode_statement()
 
+    # Hoisted out of interpolation_mode_statement so the mapping is not rebuilt on every call.
+    _interp_statements = {
+            InterpMode.LINEAR: 'G01*',
+            InterpMode.CIRCULAR_CW: 'G02*',
+            InterpMode.CIRCULAR_CCW: 'G03*'}
+
     def interpolation_mode_statement(self):
-        return {
-                InterpMode.LINEAR: 'G01*',
-                InterpMode.CIRCULAR_CW: 'G02*',
-                InterpMode.CIRCULAR_CCW: 'G03*'}[self.interpolation_mode]
+        return self._interp_statements[self.interpolation_mode]
 
 
 class GerberParser:
@@ -634,10 +707,32 @@ class GerberParser:
         'comment': r"G0?4(?P<comment>[^*]*)",
         }
 
+    _dispatch_re = None
+
+    @classmethod
+    def _compile_statement_regexes(cls):
+        # Combine all statement patterns into one alternation so each command is dispatched with a single C-level match
+        # instead of re-trying ~25 patterns in a Python loop. Alternatives are tried in dict order, exactly like the
+        # sequential loop this replaces. Each alternative keeps its capture groups (named groups get a unique
+        # per-alternative prefix against collisions) and is wrapped in a (?P<pN>...) marker group; which alternative
+        # matched follows from match.lastindex, since all matched groups lie in that alternative's group number range.
+        parts = []
+        handlers = []
+        for i, (name, exp) in enumerate(cls.STATEMENT_REGEXES.items()):
+            prefix = f'g{i}_'
+            parts.append(f'(?P<p{i}>{_rename_groups(exp, prefix)})')
+            handlers.append((re.compile(exp).groups, prefix, name))
+        cls._dispatch_re = re.compile('|'.join(parts))
+        cls._dispatch_handlers = handlers
+        cls._dispatch_bases = [ cls._dispatch_re.groupindex[f'p{i}'] for i in range(len(handlers)) ]
+
     def __init__(self, target, include_dir=None, override_settings=None):
         """ Pass an include dir to enable IF include statements (potentially DANGEROUS!). """
         self.target = target
         self.include_dir = include_dir
+        # Resolve the include dir once up front so the per-include traversal check below is a plain string prefix
+        # comparison instead of re-stat'ing every path component for each IF statement.
+        self._include_dir_prefix = str(Path(include_dir).resolve()) + os.sep if include_dir is not None else None
         self.include_stack = []
         self.file_settings = override_settings or FileSettings()
         self.graphics_state = GraphicsState(warn=self.warn, file_settings=self.file_settings)
@@ -656,7 +751,9 @@ class GerberParser:
         self.aperture_attrs = {}
         self.filename = None
         self.line = None
-        self.lineno = 0
+        self._data = ''
+        self._nl_offsets = None
+        self._line_start = None
 
     def _shorten_line(self):
         line_joined = self.line.replace('\r', '').replace('\n', '\\n')
@@ -671,37 +768,59 @@ class GerberParser:
     def _split_commands(self, data):
         # Ignore '%' signs within G04 commments because eagle likes to put completely broken file attributes inside G04
         # comments, and those contain % signs. Best of all, they're not even balanced.
-        self.lineno = 1
-        for match in re.finditer(r'G04.*?\*\s*|%.*?%\s*|[^*%]*\*\s*', data, re.DOTALL):
-            cmd = match[0]
-            newlines = cmd.count('\n')
-            cmd = cmd.strip().strip('%').rstrip('*')
+        self._data = data
+        self._nl_offsets = None
+        self._line_start = 0
+        for match in _COMMAND_SPLIT_RE.finditer(data):
+            cmd = match[0].strip().strip('%').rstrip('*')
             if cmd:
                 # Expensive, but only used in case something goes wrong.
+                self._line_start = match.start()
                 self.line = cmd
                 yield cmd
-            self.lineno += newlines
-        self.lineno = 0
+        self._line_start = None
         self.line = ''
 
+    @property
+    def lineno(self):
+        """ Line number of the statement currently being parsed. Only needed when a warning or error message is
+        produced, so instead of counting newlines per statement we index all newline positions once on first use and
+        binary-search the current statement's offset. """
+        if self._line_start is None:
+            return 0
+
+        if self._nl_offsets is None:
+            offsets = []
+            find = self._data.find
+            i = find('\n')
+            while i >= 0:
+                offsets.append(i)
+                i = find('\n', i+1)
+            self._nl_offsets = offsets
+
+        return bisect.bisect_right(self._nl_offsets, self._line_start) + 1
+
     def parse(self, data, filename=None):
         # filename arg is for error messages
         filename = self.filename = filename or '<unknown>'
 
-        regex_cache = [ (re.compile(exp), getattr(self, f'_parse_{name}')) for name, exp in self.STATEMENT_REGEXES.items() ]
+        if GerberParser._dispatch_re is None:
+            GerberParser._compile_statement_regexes()
+        dispatch = self._dispatch_re
+        bases = self._dispatch_bases
+        funs = [ (ngroups, prefix, getattr(self, f'_parse_{name}')) for ngroups, prefix, name in self._dispatch_handlers ]
 
         for line in self._split_commands(data):
             #if self.eof_found:
             #    self.warn('Data found in gerber file after EOF.')
 
-            for le_regex, fun in regex_cache:
-                if (match := le_regex.match(line)):
-                    try:
-                        fun(match)
-                    except Exception as e:
-                        raise SyntaxError(f'{filename}:{self.lineno} "{self._shorten_line()}": {e}') from e
-                    line = line[match.end(0):]
-                    break
+            if (match := dispatch.match(line)):
+                i = bisect.bisect_right(bases, match.lastindex) - 1
+                ngroups, prefix, fun = funs[i]
+                try:
+                    fun(_MatchProxy(match, bases[i], ngroups, prefix))
+                except Exception as e:
+                    raise SyntaxError(f'{filename}:{self.lineno} "{self._shorten_line()}": {e}') from e
 
             else:
                 self.warn(f'Unknown statement found: "{self._shorten_line()}", ignoring.', UnknownStatementWarning)
@@ -740,10 +859,11 @@ class GerberParser:
         elif interp == 'G55':
             self.generator_hints.append('zuken')
 
-        x = self.file_settings.parse_gerber_value(x)
+        parse = self.file_settings.parse_gerber_value
+        x = parse(x)
         if x_s:
             x = -x
-        y = self.file_settings.parse_gerber_value(y)
+        y = parse(y)
         if y_s:
             y = -y
 
@@ -777,10 +897,10 @@ class GerberParser:
                 elif self.multi_quadrant_mode:
                     self.warn('Deprecated G74 multi-quadant mode arc found. G74 is bad and you should feel bad.')
 
-            i = self.file_settings.parse_gerber_value(i)
+            i = parse(i)
             if i_s:
                 i = -i
-            j = self.file_settings.parse_gerber_value(j)
+            j = parse(j)
             if j_s:
                 j = -j
 
@@ -840,7 +960,8 @@ class GerberParser:
 
     def _parse_aperture_definition(self, match):
         # number, shape, modifiers
-        modifiers = [ float(val) for val in match['modifiers'].strip(' ,').split('X') ] if match['modifiers'] else []
+        # map() keeps the float conversions in a single C-level loop instead of one bytecode iteration per value.
+        modifiers = tuple(map(float, match['modifiers'].strip(' ,').split('X'))) if match['modifiers'] else ()
         number = int(match['number'])
 
         aperture_classes = {
@@ -861,7 +982,7 @@ class GerberParser:
                     original_number=number)
 
         elif (macro := self.aperture_macros.get(match['shape'])):
-            new_aperture = apertures.ApertureMacroInstance(macro, tuple(modifiers), unit=self.file_settings.unit,
+            new_aperture = apertures.ApertureMacroInstance(macro, modifiers, unit=self.file_settings.unit,
                     attrs=tuple(self.aperture_attrs.items()), original_number=number)
 
         else:
@@ -925,11 +1046,16 @@ class GerberParser:
         else:
             self.warn('IF include statement found. Includes are activated, but is this really a good idea?', ResourceWarning)
 
-        include_file = self.include_dir / param["filename"]
-        # Do not check if path exists to avoid leaking existence via error message
-        include_file = include_file.resolve(strict=False)
-        
-        if not include_file.is_relative_to(self.include_dir):
+        # Cheap, syscall-free rejection of obvious traversal first. Do not check if the path exists before the
+        # traversal checks to avoid leaking existence via error message.
+        candidate = os.path.normpath(os.path.join(self._include_dir_prefix, match['filename']))
+        if not candidate.startswith(self._include_dir_prefix):
+            raise FileNotFoundError('Attempted traversal to parent of include dir in path from IF include statement')
+
+        # Still resolve the candidate itself so a symlink inside the include dir cannot escape it. Unlike before, the
+        # include dir part is pre-resolved, so this stats the include path only.
+        include_file = Path(candidate).resolve(strict=False)
+        if not str(include_file).startswith(self._include_dir_prefix):
             raise FileNotFoundError('Attempted traversal to parent of include dir in path from IF include statement')
 
         if not include_file.is_file():
@@ -940,7 +1066,7 @@ class GerberParser:
         self.include_stack.append(include_file)
 
         # Spec 2020-09 section 3.1: Gerber files must use UTF-8
-        self._parse(f.read_text(encoding='UTF-8'), filename=include_file.name)
+        self.parse(include_file.read_text(encoding='UTF-8'), filename=include_file.name)
         self.include_stack.pop()
 
     def _parse_image_name(self, match):
@@ -985,7 +1111,9 @@ class GerberParser:
     def _parse_scale_factor(self, match):
         a = float(match['sa']) if match['sa'] else 1.0
         b = float(match['sb']) if match['sb'] else 1.0
-        if not math.isclose(math.dist((a, b), (1, 1)), 0):
+        # math.isclose(d, 0) with its default abs_tol=0 is only true for d == 0, so the old
+        # math.dist((a, b), (1, 1)) round-trip was just an equality test in disguise.
+        if (a, b) != (1.0, 1.0):
             self.warn('Deprecated SF (scale factor) statement found. This deprecated since rev. I1 (Dec 2012).', DeprecationWarning)
         self.graphics_state.image_scale = a, b
 
@@ -1019,7 +1147,7 @@ class GerberParser:
                     self.layer_hints.append('bottom silk')
             elif 'ETCH' in cmt:
                 _1, _2, name = cmt.partition('/')
-                name = re.sub(r'\W+', '_', name)
+                name = _NON_WORD_RE.sub('_', name)
                 self.layer_hints.append(f'{name} copper')
 
         elif cmt.startswith('Mentor Graphics'):
@@ -28,35 +28,52 @@ import stat
 import random
 import statistics
 from functools import total_ordering
+from concurrent.futures import ThreadPoolExecutor
 import shutil
-import bs4
 from contextlib import contextmanager
 import hashlib
 
 import tqdm
 import numpy as np
 from PIL import Image
+from lxml import etree
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
 
 cachedir = Path(__file__).parent / 'image_cache'
 cachedir.mkdir(exist_ok=True)
 
-@total_ordering
 class ImageDifference:
+    # The comparison operators are spelled out instead of using functools.total_ordering since the generated operators
+    # route every comparison through two Python-level calls, and the test suite compares thousands of these.
+    __slots__ = ('value', 'histogram', '_f')
+
     def __init__(self, value, histogram):
         self.value = value
         self.histogram = histogram
+        self._f = float(value)
 
     def __float__(self):
-        return float(self.value)
+        return self._f
 
     def __eq__(self, other):
-        return float(self) == float(other)
+        return self._f == float(other)
 
     def __lt__(self, other):
-        return float(self) < float(other)
+        return self._f < float(other)
+
+    def __le__(self, other):
+        return self._f <= float(other)
+
+    def __gt__(self, other):
+        return self._f > float(other)
+
+    def __ge__(self, other):
+        return self._f >= float(other)
 
     def __str__(self):
-        return str(float(self))
+        return str(self._f)
 
 @total_ordering
 class Histogram:
@@ -64,13 +81,15 @@ class Histogram:
         self.value, self.size = value, size
 
     def __eq__(self, other):
+        # None entries in the reference histogram are wildcards. np.where substitutes them in one pass instead of
+        # computing the mask twice for fancy-indexing both sides.
         other = np.array(other)
-        other[other == None] = self.value[other == None]
+        other = np.where(other == None, self.value, other)
         return (self.value == other).all()
 
     def __lt__(self, other):
         other = np.array(other)
-        other[other == None] = self.value[other == None]
+        other = np.where(other == None, self.value, other)
         return (self.value <= other).all()
 
     def __getitem__(self, index):
@@ -90,6 +109,12 @@ def run_cargo_cmd(cmd, args, **kwargs):
     except FileNotFoundError:
         return subprocess.run([str(Path.home() / '.cargo' / 'bin' / cmd), *args], **kwargs)
 
+def _run_parallel(*jobs):
+    # The exporters below are pure shell-outs, so plain threads are enough to overlap the external renderers.
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        for fut in [pool.submit(job) for job in jobs]:
+            fut.result()
+
 def svg_to_png(in_svg, out_png, dpi=100, bg=None):
     params = f'{dpi}{bg}'.encode()
     digest = hashlib.blake2b(Path(in_svg).read_bytes() + params).hexdigest()
@@ -97,7 +122,11 @@ def svg_to_png(in_svg, out_png, dpi=100, bg=None):
 
     if not cachefile.is_file():
         bg = 'black' if bg is None else bg
-        run_cargo_cmd('resvg', ['--background', bg, '--dpi', str(dpi), in_svg, cachefile], check=True, stdout=subprocess.DEVNULL)
+        # Render into a private file and atomically move it into place so concurrent renders of the same input
+        # (parallel exports below, or pytest-xdist workers) never observe a half-written cache entry.
+        with tempfile.NamedTemporaryFile(suffix='.png', dir=cachedir, delete=False) as tmp_out:
+            run_cargo_cmd('resvg', ['--background', bg, '--dpi', str(dpi), in_svg, tmp_out.name], check=True, stdout=subprocess.DEVNULL)
+            os.replace(tmp_out.name, cachefile)
 
     shutil.copy(cachefile, out_png)
 
@@ -137,13 +166,15 @@ def gerbv_export(in_gbr, out_svg, export_format='svg', origin=(0, 0), size=(6, 6
 
             x, y = origin
             w, h = size
-            cmd = ['gerbv', '-x', export_format,
-                '--border=0',
-                f'--origin={x:.6f}x{y:.6f}', f'--window_inch={w:.6f}x{h:.6f}',
-                f'--background={bg}',
-                f'--foreground={fg}',
-                '-o', str(cachefile), '-p', f.name]
-            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            with tempfile.NamedTemporaryFile(suffix='.svg', dir=cachedir, delete=False) as tmp_out:
+                cmd = ['gerbv', '-x', export_format,
+                    '--border=0',
+                    f'--origin={x:.6f}x{y:.6f}', f'--window_inch={w:.6f}x{h:.6f}',
+                    f'--background={bg}',
+                    f'--foreground={fg}',
+                    '-o', tmp_out.name, '-p', f.name]
+                subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                os.replace(tmp_out.name, cachefile)
     else:
         print(f'Re-using cache for {Path(in_gbr).name}')
     shutil.copy(cachefile, out_svg)
@@ -211,23 +242,27 @@ def bulk_populate_kicad_fp_export_cache(pretty_dir):
                     shutil.copy(out_file, cachefile(fn))
 
 @contextmanager
-def svg_soup(filename):
-    with open(filename, 'r') as f:
-        soup = bs4.BeautifulSoup(f.read(), 'xml')
+def svg_tree(filename):
+    # lxml instead of bs4 here: the gerbv output SVGs easily reach tens of megabytes, and rewriting them through
+    # bs4's Python-level tree model dominated test run time. lxml does both parse and serialize in C.
+    tree = etree.parse(str(filename))
 
-    yield soup
+    yield tree
 
-    with open(filename, 'w') as f:
-        f.write(str(soup))
+    tree.write(str(filename), xml_declaration=True, encoding='UTF-8')
 
-def cleanup_gerbv_svg(soup):
-    width = soup.svg["width"]
-    height = soup.svg["height"]
+def _prefix_id(elem, prefix):
+    elem.set('id', prefix + elem.get('id', str(id(elem))))
+
+def cleanup_gerbv_svg(tree):
+    svg = tree.getroot()
+    width = svg.get('width')
+    height = svg.get('height')
     width = width[:-2] if width.endswith('pt') else width
     height = height[:-2] if height.endswith('pt') else height
-    soup.svg['width'] = f'{float(width)/72*25.4:.4f}mm'
-    soup.svg['height'] = f'{float(height)/72*25.4:.4f}mm'
-    for group in soup.find_all('g'):
+    svg.set('width', f'{float(width)/72*25.4:.4f}mm')
+    svg.set('height', f'{float(height)/72*25.4:.4f}mm')
+    for group in svg.iter(f'{{{SVG_NS}}}g'):
         # gerbv uses Cairo's SVG canvas. Cairo's SVG canvas is kind of broken. It has no support for unit
         # handling at all, which means the output files just end up being in pixels at 72 dpi. Further, it
         # seems gerbv's aperture macro rendering interacts poorly with Cairo's SVG export. gerbv renders
@@ -235,28 +270,28 @@ def cleanup_gerbv_svg(soup):
         # canvas size. This is just wrong, so we just nuke the clip path from these SVG groups here.
         #
         # Apart from being graphically broken, this additionally causes very bad rendering performance.
-        del group['clip-path']
+        group.attrib.pop('clip-path', None)
 
 def gerber_difference(reference, actual, diff_out=None, svg_transform=None, size=(10,10), ref_unit_spec=None):
     with tempfile.NamedTemporaryFile(suffix='.svg') as act_svg,\
         tempfile.NamedTemporaryFile(suffix='.svg') as ref_svg:
 
-        gerbv_export(reference, ref_svg.name, size=size, export_format='svg', override_unit_spec=ref_unit_spec)
-        gerbv_export(actual, act_svg.name, size=size, export_format='svg')
+        _run_parallel(
+                lambda: gerbv_export(reference, ref_svg.name, size=size, export_format='svg', override_unit_spec=ref_unit_spec),
+                lambda: gerbv_export(actual, act_svg.name, size=size, export_format='svg'))
 
-        with svg_soup(ref_svg.name) as soup:
+        with svg_tree(ref_svg.name) as tree:
             if svg_transform is not None:
-                svg = soup.svg
-                children = list(svg.children)
-                g = soup.new_tag('g', attrs={'transform': svg_transform})
+                svg = tree.getroot()
+                children = list(svg)
+                g = etree.SubElement(svg, f'{{{SVG_NS}}}g', transform=svg_transform)
                 for c in children:
-                    g.append(c.extract())
-                svg.append(g)
+                    g.append(c) # re-parents the element into the new group
 
-            cleanup_gerbv_svg(soup)
+            cleanup_gerbv_svg(tree)
 
-        with svg_soup(act_svg.name) as soup:
-            cleanup_gerbv_svg(soup)
+        with svg_tree(act_svg.name) as tree:
+            cleanup_gerbv_svg(tree)
 
         return svg_difference(ref_svg.name, act_svg.name, diff_out=diff_out)
 
@@ -265,63 +300,60 @@ def gerber_difference_merge(ref1, ref2, actual, diff_out=None, composite_out=Non
         tempfile.NamedTemporaryFile(suffix='.svg') as ref1_svg,\
         tempfile.NamedTemporaryFile(suffix='.svg') as ref2_svg:
 
-        gerbv_export(ref1, ref1_svg.name, size=size, export_format='svg')
-        gerbv_export(ref2, ref2_svg.name, size=size, export_format='svg')
-        gerbv_export(actual, act_svg.name, size=size, export_format='svg')
+        _run_parallel(
+                lambda: gerbv_export(ref1, ref1_svg.name, size=size, export_format='svg'),
+                lambda: gerbv_export(ref2, ref2_svg.name, size=size, export_format='svg'),
+                lambda: gerbv_export(actual, act_svg.name, size=size, export_format='svg'))
         for var in ['ref1_svg', 'ref2_svg', 'act_svg']:
             print(f'=== {var} ===')
             print(Path(locals()[var].name).read_text().splitlines()[1])
 
-        with svg_soup(ref1_svg.name) as soup1:
+        with svg_tree(ref1_svg.name) as tree1:
+            svg1 = tree1.getroot()
             if svg_transform1 is not None:
-                svg = soup1.svg
-                children = list(svg.children)
-                g = soup1.new_tag('g', attrs={'transform': svg_transform1})
+                children = list(svg1)
+                g = etree.SubElement(svg1, f'{{{SVG_NS}}}g', transform=svg_transform1)
                 for c in children:
-                    g.append(c.extract())
-                svg.append(g)
-            cleanup_gerbv_svg(soup1)
+                    g.append(c)
+            cleanup_gerbv_svg(tree1)
 
-            with svg_soup(ref2_svg.name) as soup2:
+            with svg_tree(ref2_svg.name) as tree2:
+                svg2 = tree2.getroot()
                 if svg_transform2 is not None:
-                    svg = soup2.svg
-                    children = list(svg.children)
-                    g = soup2.new_tag('g', attrs={'transform': svg_transform2})
+                    children = list(svg2)
+                    g = etree.SubElement(svg2, f'{{{SVG_NS}}}g', transform=svg_transform2)
                     for c in children:
-                        g.append(c.extract())
-                    svg.append(g)
-                cleanup_gerbv_svg(soup2)
-
-                defs1 = soup1.find('defs')
-                if not defs1:
-                    defs1 = soup1.new_tag('defs')
-                    soup1.find('svg').insert(0, defs1)
-
-                defs2 = soup2.find('defs')
-                if defs2:
-                    defs2 = defs2.extract()
-                    # explicitly convert .contents into list here and below because else bs4 stumbles over itself
-                    # iterating because we modify the tree in the loop body.
-                    for c in list(defs2.contents):
-                        if hasattr(c, 'attrs'):
-                            c['id'] = 'gn-merge-b-' + c.attrs.get('id', str(id(c)))
+                        g.append(c)
+                cleanup_gerbv_svg(tree2)
+
+                defs1 = svg1.find(f'{{{SVG_NS}}}defs')
+                if defs1 is None:
+                    defs1 = etree.Element(f'{{{SVG_NS}}}defs')
+                    svg1.insert(0, defs1)
+
+                defs2 = svg2.find(f'{{{SVG_NS}}}defs')
+                if defs2 is not None:
+                    svg2.remove(defs2)
+                    # materialize the child list since appending to defs1 re-parents elements out of defs2
+                    for c in list(defs2):
+                        if isinstance(c.tag, str): # skip comments and processing instructions
+                            _prefix_id(c, 'gn-merge-b-')
                         defs1.append(c)
 
-                for use in soup2.find_all('use', recursive=True):
-                    if (href := use.get('xlink:href', '')).startswith('#'):
-                        use['xlink:href'] = f'#gn-merge-b-{href[1:]}'
+                for use in svg2.iter(f'{{{SVG_NS}}}use'):
+                    if (href := use.get(f'{{{XLINK_NS}}}href', '')).startswith('#'):
+                        use.set(f'{{{XLINK_NS}}}href', f'#gn-merge-b-{href[1:]}')
 
-                svg1 = soup1.find('svg')
-                for c in list(soup2.find('svg').contents):
-                    if hasattr(c, 'attrs'):
-                        c['id'] = 'gn-merge-b-' + c.attrs.get('id', str(id(c)))
+                for c in list(svg2):
+                    if isinstance(c.tag, str):
+                        _prefix_id(c, 'gn-merge-b-')
                     svg1.append(c)
 
         if composite_out:
             shutil.copyfile(ref1_svg.name, composite_out)
 
-        with svg_soup(act_svg.name) as soup:
-            cleanup_gerbv_svg(soup)
+        with svg_tree(act_svg.name) as tree:
+            cleanup_gerbv_svg(tree)
 
         return svg_difference(ref1_svg.name, act_svg.name, diff_out=diff_out)
 
@@ -329,18 +361,21 @@ def svg_difference(reference, actual, diff_out=None, background=None, dpi=100):
     with tempfile.NamedTemporaryFile(suffix='-ref.png') as ref_png,\
         tempfile.NamedTemporaryFile(suffix='-act.png') as act_png:
 
-        svg_to_png(reference, ref_png.name, bg=background, dpi=dpi)
-        svg_to_png(actual, act_png.name, bg=background, dpi=dpi)
+        _run_parallel(
+                lambda: svg_to_png(reference, ref_png.name, bg=background, dpi=dpi),
+                lambda: svg_to_png(actual, act_png.name, bg=background, dpi=dpi))
 
         return image_difference(ref_png.name, act_png.name, diff_out=diff_out)
 
 def image_difference(reference, actual, diff_out=None):
-    ref = np.array(Image.open(reference)).astype(float)
-    out = np.array(Image.open(actual)).astype(float)
-
-    ref, out = ref.mean(axis=2), out.mean(axis=2) # convert to grayscale
+    # mean() upcasts to float64 internally, so reducing to grayscale before converting avoids materializing full-size
+    # float copies of both RGB arrays. The in-place ops below then reuse one buffer instead of allocating three.
+    ref = np.array(Image.open(reference)).mean(axis=2) # convert to grayscale
+    out = np.array(Image.open(actual)).mean(axis=2)
     # TODO blur images here before comparison to mitigate aliasing issue
-    delta = np.abs(out - ref).astype(float) / 255
+    delta = np.subtract(out, ref, out=out)
+    np.abs(delta, out=delta)
+    delta /= 255
     if diff_out:
         Image.fromarray((delta*255).astype(np.uint8), mode='L').save(diff_out)
 
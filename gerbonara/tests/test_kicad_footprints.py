@@ -4,10 +4,10 @@ from itertools import zip_longest
 import subprocess
 import re
 
-import bs4
+from lxml import etree
 
 from .utils import tmpfile, print_on_error
-from .image_support import kicad_fp_export, svg_difference, svg_soup, svg_to_png, run_cargo_cmd
+from .image_support import kicad_fp_export, svg_difference, svg_tree, svg_to_png, run_cargo_cmd, SVG_NS
 
 from .. import graphic_objects as go
 from ..utils import MM, arc_bounds, sum_bounds
@@ -72,13 +72,12 @@ def test_round_trip(kicad_mod_file):
 
 def _compute_style(elem):
     current_style = {}
-    for elem in [*reversed(list(elem.parents)), elem]:
-        attrs = dict(elem.attrs)
-        for match in re.finditer(r'([^:;]+):([^:;]+)', attrs.pop('style', '')):
+    for elem in [*reversed(list(elem.iterancestors())), elem]:
+        for match in re.finditer(r'([^:;]+):([^:;]+)', elem.get('style', '')):
             k, v = match.groups()
             current_style[k.strip().lower()] = v.strip()
 
-        for k, v in elem.attrs.items():
+        for k, v in elem.attrib.items():
             current_style[k.lower()] = v
     return current_style
 
@@ -232,14 +231,15 @@ def test_render(kicad_mod_file, tmpfile, print_on_error):
     # KiCad's bounding box calculation for SVG output looks broken, and the resulting files have viewports that are too
     # large. We align our output and KiCad's output using the footprint's courtyard layer.
     points = []
-    with svg_soup(ref_svg) as soup:
-        for group in soup.find_all('g'):
+    with svg_tree(ref_svg) as tree:
+        root = tree.getroot()
+        for group in root.iter(f'{{{SVG_NS}}}g'):
             style = group.get('style', '').lower().replace(' ', '')
             if 'fill:#ff26e2' not in style or 'stroke:#ff26e2' not in style:
                 continue
 
             # This group contains courtyard layer items.
-            for path in group.find_all('path'):
+            for path in group.iter(f'{{{SVG_NS}}}path'):
                 points += _parse_path_d(path)
 
         if not points:
@@ -257,18 +257,18 @@ def test_render(kicad_mod_file, tmpfile, print_on_error):
         max_y += margin
         w, h = max_x-min_x, max_y-min_y
 
-        root = soup.find('svg')
-        root_w = root['width'] = f'{w:.6f}mm'
-        root_h = root['height'] = f'{h:.6f}mm'
-        root['viewBox'] = f'{min_x:.6f} {min_y:.6f} {w:.6f} {h:.6f}'
+        root_w = f'{w:.6f}mm'
+        root_h = f'{h:.6f}mm'
+        root.set('width', root_w)
+        root.set('height', root_h)
+        root.set('viewBox', f'{min_x:.6f} {min_y:.6f} {w:.6f} {h:.6f}')
 
         # nuke text since kicad-cli's text positioning looks sligthly wonky and we failed to replicate that wonkyness
-        # exactly. 
-        for elem in soup.find_all('g', attrs={'class': 'stroked-text'}):
-            elem.decompose()
-
-        for elem in soup.find_all('text'):
-            elem.decompose()
+        # exactly.
+        doomed = [g for g in root.iter(f'{{{SVG_NS}}}g') if g.get('class') == 'stroked-text']
+        doomed += root.iter(f'{{{SVG_NS}}}text')
+        for elem in doomed:
+            elem.getparent().remove(elem)
 
     # Currently, there is a bug in resvg leading to mis-rendering. On the file below from the KiCad standard lib, resvg
     # renders all round pads in a wrong color (?). Interestingly, passing the file through usvg before rendering fixes
@@ -276,40 +276,41 @@ def test_render(kicad_mod_file, tmpfile, print_on_error):
     # Sample footprint: Connector_PinSocket_2.00mm.pretty/PinSocket_2x11_P2.00mm_Vertical.kicad_mod
     run_cargo_cmd('usvg', [str(ref_svg), str(ref_svg)])
 
-    with svg_soup(ref_svg) as soup:
+    with svg_tree(ref_svg) as tree:
         # fix up usvg width/height
-        root = soup.find('svg')
-        root['width'] = root_w
-        root['height'] = root_h
+        root = tree.getroot()
+        root.set('width', root_w)
+        root.set('height', root_h)
 
-        #for elem in root.find_all('path'):
-        #    if elem.attrs.get('fill', '').lower() == '#d864ff' and math.isclose(float(elem.attrs.get('fill-opacity', 0)), 0.4): 
-        #        elem.decompose()
+        #for elem in root.iter(f'{{{SVG_NS}}}path'):
+        #    if elem.get('fill', '').lower() == '#d864ff' and math.isclose(float(elem.get('fill-opacity', 0)), 0.4):
+        #        elem.getparent().remove(elem)
 
         # remove alpha to avoid complicated filter hacks
-        for elem in root.descendants:
-            if not isinstance(elem, bs4.Tag):
+        for elem in root.iter():
+            if not isinstance(elem.tag, str): # skip comments and processing instructions
                 continue
 
-            if elem.has_attr('opacity'):
-                elem['opacity'] = '1'
+            if 'opacity' in elem.attrib:
+                elem.set('opacity', '1')
 
-            if elem.has_attr('fill-opacity'):
-                elem['fill-opacity'] = '1'
+            if 'fill-opacity' in elem.attrib:
+                elem.set('fill-opacity', '1')
 
-            if elem.has_attr('stroke-opacity'):
-                elem['stroke-opacity'] = '1'
+            if 'stroke-opacity' in elem.attrib:
+                elem.set('stroke-opacity', '1')
 
         # kicad-cli incorrectly fills arcs
-        for elem in root.find_all('path'):
+        for elem in root.iter(f'{{{SVG_NS}}}path'):
             if ' C ' in elem.get('d', '') and elem.get('stroke', 'none') != 'none':
-                elem['fill'] = 'none'
+                elem.set('fill', 'none')
 
     # Move fabrication layers above drills because kicad-cli's svg rendering is wonky.
-    with svg_soup(out_svg) as soup:
-        root = soup.find('svg')
-        root.append(soup.find('g', id='l-bottom-fabrication').extract())
-        root.append(soup.find('g', id='l-top-fabrication').extract())
+    with svg_tree(out_svg) as tree:
+        root = tree.getroot()
+        # append() re-parents the groups to the end of the document
+        root.append(root.find(f'.//{{{SVG_NS}}}g[@id="l-bottom-fabrication"]'))
+        root.append(root.find(f'.//{{{SVG_NS}}}g[@id="l-top-fabrication"]'))
 
     svg_to_png(ref_svg, tmpfile('Reference render', '.png'), bg=None, dpi=600)
     svg_to_png(out_svg, tmpfile('Output render', '.png'), bg=None, dpi=600)
@@ -26,6 +26,7 @@ This module provides utility functions for working with Gerber and Excellon file
 """
 
 from dataclasses import dataclass
+import bisect
 import os
 import re
 import textwrap
@@ -37,23 +38,97 @@ class UnknownStatementWarning(Warning):
     """ Gerbonara found an unknown Gerber or Excellon statement. """
     pass
 
+def _rename_groups(regex, prefix):
+    """ Internal helper that prefixes the names of all named groups (and their backreferences) of the given regex, so
+    that several regexes can be combined into one alternation without group name collisions. """
+    out = []
+    i, n = 0, len(regex)
+    in_class = False
+    while i < n:
+        c = regex[i]
+        if c == '\\':
+            out.append(regex[i:i+2])
+            i += 2
+        elif in_class:
+            in_class = (c != ']')
+            out.append(c)
+            i += 1
+        elif c == '[':
+            in_class = True
+            out.append(c)
+            i += 1
+        elif c == '(' and regex.startswith('(?P<', i):
+            out.append('(?P<' + prefix)
+            i += 4
+        elif c == '(' and regex.startswith('(?P=', i):
+            out.append('(?P=' + prefix)
+            i += 4
+        else:
+            out.append(c)
+            i += 1
+    return ''.join(out)
+
+
+class _MatchProxy:
+    """ Internal lightweight stand-in for :py:class:`re.Match` that exposes one alternative of a
+    :py:class:`RegexMatcher` combined pattern under that alternative's original group numbers and names. """
+    __slots__ = ('_match', '_base', '_ngroups', '_prefix')
+
+    def __init__(self, match, base, ngroups, prefix):
+        self._match = match
+        self._base = base
+        self._ngroups = ngroups
+        self._prefix = prefix
+
+    def group(self, group=0):
+        if isinstance(group, str):
+            return self._match.group(self._prefix + group)
+        return self._match.group(self._base + group)
+
+    __getitem__ = group
+
+    def groups(self, default=None):
+        return self._match.groups(default)[self._base : self._base+self._ngroups]
+
+
 class RegexMatcher:
     """ Internal parsing helper """
     def __init__(self):
         self.mapping = {}
+        self._dispatch = None
 
     def match(self, regex):
         def wrapper(fun):
             nonlocal self
             self.mapping[regex] = fun
+            self._dispatch = None
             return fun
         return wrapper
 
+    def _finalize(self):
+        # Compile all registered patterns into one big alternation so handle() below can dispatch each line with a
+        # single C-level match instead of re-trying every pattern in a Python loop. Each alternative keeps its capture
+        # groups (named groups get a unique per-alternative prefix) and is wrapped into a (?P<pN>...) marker group, so
+        # the one match yields both the dispatch decision and the handler's groups. Which alternative matched follows
+        # from match.lastindex: all groups of the matched alternative, and only those, lie in its group number range.
+        self._handlers = []
+        parts = []
+        for i, (regex, handler) in enumerate(self.mapping.items()):
+            prefix = f'g{i}_'
+            parts.append(f'(?P<p{i}>{_rename_groups(regex, prefix)})')
+            self._handlers.append((re.compile(regex).groups, prefix, handler))
+        self._dispatch = re.compile('|'.join(parts))
+        self._bases = [ self._dispatch.groupindex[f'p{i}'] for i in range(len(self._handlers)) ]
+
     def handle(self, inst, line):
-        for regex, handler in self.mapping.items():
-            if (match := re.fullmatch(regex, line)):
-                handler(inst, match)
-                return True
+        if self._dispatch is None:
+            self._finalize()
+
+        if (match := self._dispatch.fullmatch(line)):
+            i = bisect.bisect_right(self._bases, match.lastindex) - 1
+            ngroups, prefix, handler = self._handlers[i]
+            handler(inst, _MatchProxy(match, self._bases[i], ngroups, prefix))
+            return True
         else:
             return False
 
@@ -78,11 +153,15 @@ class LengthUnit:
         :rtype: float
         """
 
+        # Identity check first: LengthUnit is a singleton, so the common same-unit case needs neither the isinstance
+        # check nor the Python-level __eq__ call.
+        if unit is self or unit is None or value is None:
+            return value
+
         if isinstance(unit, str):
             unit = units[unit]
-
-        if unit == self or unit is None or value is None:
-            return value
+            if unit is self:
+                return value
 
         return value * unit.this_in_mm / self.this_in_mm
 
@@ -217,31 +296,36 @@ def decimal_string(value, precision=6, padding=False):
 
     """
     floatstr = '%0.10g' % value
-    integer = None
-    decimal = None
-    if '.' in floatstr:
-        integer, decimal = floatstr.split('.')
-    elif ',' in floatstr:
-        integer, decimal = floatstr.split(',')
-    else:
-        integer, decimal = floatstr, "0"
+    integer, sep, decimal = floatstr.partition('.')
+    if not sep:
+        integer, sep, decimal = floatstr.partition(',')
+    if not sep:
+        decimal = '0'
 
     if len(decimal) > precision:
         decimal = decimal[:precision]
     elif padding:
         decimal = decimal + (precision - len(decimal)) * '0'
 
-    if integer or decimal:
-        return ''.join([integer, '.', decimal])
-    else:
-        return int(floatstr)
+    return f'{integer}.{decimal}'
 
 
 def rotate_point(x, y, angle, cx=0, cy=0):
     """ Rotate point (x,y) around (cx,cy) by ``angle`` radians clockwise. """
 
-    return (cx + (x - cx) * math.cos(-angle) - (y - cy) * math.sin(-angle),
-            cy + (x - cx) * math.sin(-angle) + (y - cy) * math.cos(-angle))
+    cos, sin = math.cos(-angle), math.sin(-angle)
+    dx, dy = x - cx, y - cy
+    return (cx + dx * cos - dy * sin,
+            cy + dx * sin + dy * cos)
+
+
+def rotate_points(points, angle, cx=0, cy=0):
+    """ Rotate all ``(x, y)`` tuples in ``points`` around (cx,cy) by ``angle`` radians clockwise. Use this over calling
+    :py:func:`rotate_point` in a loop when rotating many points, since the rotation matrix is computed only once. """
+
+    cos, sin = math.cos(-angle), math.sin(-angle)
+    return [ (cx + (dx := x - cx) * cos - (dy := y - cy) * sin,
+              cy + dx * sin + dy * cos) for x, y in points ]
 
 
 def sweep_angle(cx, cy, x1, y1, x2, y2, clockwise):
@@ -254,17 +338,17 @@ def sweep_angle(cx, cy, x1, y1, x2, y2, clockwise):
     x2, y2 = x2-cx, y2-cy
 
     a1, a2 = math.atan2(y1, x1), math.atan2(y2, x2)
-    f = abs(a2 - a1)
+    # The sign of (a2 - a1) is known in each branch, so no abs() calls are needed.
     if not clockwise:
         if a2 > a1:
             return a2 - a1
         else:
-            return 2*math.pi - abs(a2 - a1)
+            return 2*math.pi - (a1 - a2)
     else:
         if a1 > a2:
             return a1 - a2
         else:
-            return 2*math.pi - abs(a1 - a2)
+            return 2*math.pi - (a2 - a1)
 
 
 def approximate_arc(cx, cy, x1, y1, x2, y2, clockwise, max_error=1e-2, clip_max_error=True):
@@ -342,16 +426,24 @@ def sum_bounds(bounds, *, default=None):
     :rtype: tuple
     """
 
-    bounds = iter([ b for b in bounds if b is not None ])
+    bounds = (b for b in bounds if b is not None)
 
     for (min_x, min_y), (max_x, max_y) in bounds:
         break
     else:
         return default
 
+    # Inlined min_none/max_none -- this is the innermost loop of bounding box calculation, and four function calls
+    # per object add up on large files.
     for (min_x_2, min_y_2), (max_x_2, max_y_2) in bounds:
-        min_x, min_y = min_none(min_x, min_x_2), min_none(min_y, min_y_2)
-        max_x, max_y = max_none(max_x, max_x_2), max_none(max_y, max_y_2)
+        if min_x_2 is not None and (min_x is None or min_x_2 < min_x):
+            min_x = min_x_2
+        if min_y_2 is not None and (min_y is None or min_y_2 < min_y):
+            min_y = min_y_2
+        if max_x_2 is not None and (max_x is None or max_x_2 > max_x):
+            max_x = max_x_2
+        if max_y_2 is not None and (max_y is None or max_y_2 > max_y):
+            max_y = max_y_2
 
     return ((min_x, min_y), (max_x, max_y))
 